@@ -1,15 +1,18 @@
 """
 analytics.py — Spending analytics: summaries and matplotlib charts
-Saves charts as PNG files for web display.
+Saves charts as SVG files for web display.
 """
 
 import os
-from collections import defaultdict
-from datetime import datetime
+import re
+import tempfile
+import threading
 import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
 
 from budget import Budget
 from expense import Expense
@@ -17,114 +20,257 @@ from expense import Expense
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CHART_DIR = os.path.join(BASE_DIR, "static", "charts")
 
+# SVG skips Agg rasterization and PNG/zlib encoding entirely; these plots
+# have few elements, so the vector output is small and scales cleanly.
+CHART_FORMAT = "svg"
+# Resolution for any rasterized artists embedded in the SVG
+CHART_DPI = 96
+# Past this many points the line chart's data layer is rasterized
+RASTERIZE_POINTS = 500
+
+# Tick formatters and locators, built once at import. ax.clear() drops
+# whatever is attached to an axis, so each render re-attaches these same
+# objects. Attaching one rebinds its axis and formatting stores tick
+# locations on it, so each belongs to exactly one chart and is only used
+# under that chart's lock.
+def _peso(x, _):
+    return f"₱{x:,.0f}"
+
+
+_PESO_FMT_LINE = FuncFormatter(_peso)
+_PESO_FMT_BAR = FuncFormatter(_peso)
+_DAY_FMT = mdates.DateFormatter("%b %d")
+_DAY_LOCATOR = mdates.AutoDateLocator()
+
+# Categories are a fixed set, so pie colours and explode offsets are
+# precomputed; each category also keeps the same colour in every chart.
+_CAT_COLORS = {cat: matplotlib.colormaps["Set3"].colors[i]
+               for i, cat in enumerate(Expense.CATEGORIES)}
+_EXPLODE = [0.04] * len(Expense.CATEGORIES)
+
 
 class Analytics:
     def __init__(self, budget: Budget):
         self.budget = budget
+        # One figure per chart, reused across renders (cleared, not rebuilt).
+        # Built on the Agg canvas directly so pyplot's global state is
+        # never involved; each figure has its own lock.
+        self._figs = {
+            "pie": self._new_figure((7, 5), left=0.05, right=0.95,
+                                    top=0.88, bottom=0.04),
+            "line": self._new_figure((9, 4), left=0.11, right=0.97,
+                                     top=0.9, bottom=0.2),
+            "monthly": self._new_figure((9, 4), left=0.11, right=0.97,
+                                        top=0.9, bottom=0.13),
+        }
+        self._locks = {name: threading.Lock() for name in self._figs}
         os.makedirs(CHART_DIR, exist_ok=True)
+        # Versions only order renders within one run: a run that died before
+        # its rewrite reached disk restarts from the same mtime and would
+        # reuse its version numbers. Start every run with no charts.
+        for entry in os.scandir(CHART_DIR):
+            if entry.is_file():
+                os.remove(entry.path)
+
+    @staticmethod
+    def _new_figure(figsize, **margins):
+        # Fixed margins instead of tight_layout()/bbox_inches="tight",
+        # which each cost an extra layout pass per render.
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        fig.add_subplot()
+        fig.subplots_adjust(**margins)
+        return fig
+
+    # ── Chart Cache ──────────────────────────
+    # Every chart file is named <chart>_<month or "all">_<version>, so a file
+    # that exists is already up to date and each viewed month keeps its own.
+    # The version is the one the chart's data was read at (Budget.snapshot),
+    # never re-read later, so a mutation mid-render can't mislabel a file.
+    @staticmethod
+    def _chart_file(name, version, month=None):
+        # Dates hold only digits and hyphens, so a month with anything else
+        # matches no expense and never gets this far; strip it from the name.
+        tag = re.sub(r"[^0-9-]", "", month) if month else "all"
+        return f"{name}_{tag}_{version}.{CHART_FORMAT}"
+
+    def _cached(self, fname):
+        """Return the chart URL if that file was already rendered."""
+        if os.path.exists(os.path.join(CHART_DIR, fname)):
+            return f"static/charts/{fname}"
+        return None
+
+    def _save(self, name, fname, fig, version):
+        """Write a rendered figure to CHART_DIR and return its URL; files of
+        the same chart left over from older data versions are deleted.
+
+        The figure is written to a temp file and renamed into place, so
+        _cached() never sees a half-written or truncated chart."""
+        fd, tmp = tempfile.mkstemp(dir=CHART_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                fig.savefig(f, format=CHART_FORMAT, dpi=CHART_DPI)
+            os.replace(tmp, os.path.join(CHART_DIR, fname))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        for old in os.listdir(CHART_DIR):
+            m = re.fullmatch(rf"{name}_[^_]*_(\d+)\.{CHART_FORMAT}", old)
+            if m and int(m[1]) < version:
+                try:
+                    os.remove(os.path.join(CHART_DIR, old))
+                except FileNotFoundError:
+                    pass
+        return f"static/charts/{fname}"
 
     # ── Aggregation Helpers ───────────────────
-    def _by_category(self, expenses):
-        totals = defaultdict(float)
-        for e in expenses:
-            totals[e.category] += e.amount
-        return dict(totals)
-
-    def _by_day(self, expenses):
-        totals = defaultdict(float)
-        for e in expenses:
-            totals[e.date] += e.amount
-        return dict(sorted(totals.items()))
-
-    def _by_month(self, expenses):
-        totals = defaultdict(float)
-        for e in expenses:
-            totals[e.date[:7]] += e.amount
-        return dict(sorted(totals.items()))
+    @staticmethod
+    def _run_sums(keys, amounts):
+        """Sum amounts over runs of equal keys. Keys must already be sorted
+        (Budget keeps them so), which makes this one linear pass."""
+        if not len(keys):
+            return {}
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        return dict(zip(keys[starts].tolist(),
+                        np.add.reduceat(amounts, starts).tolist()))
+
+    def _by_category(self, month=None):
+        return self.budget.category_totals(month)
+
+    def _by_day(self, month=None):
+        amounts, _, days = self.budget.columns(month)
+        return self._run_sums(days, amounts)
+
+    def _by_month(self):
+        return self.budget.month_totals()
+
+    def _aggregate_all(self, month=None):
+        """Category, day and month totals plus the grand total and row count.
+        Only the daily series is aggregated here; the rest are Budget's
+        running sums. Month totals always cover every expense since the
+        monthly chart is never filtered."""
+        amounts, _, days = self.budget.columns(month)
+        return (self._by_category(month), self._run_sums(days, amounts),
+                self._by_month(), self.budget.get_totals(month=month), len(amounts))
 
     # ── Summary Data ─────────────────────────
     def summary(self, month=None):
-        expenses = self.budget.read_all(month=month)
-        total = sum(e.amount for e in expenses)
-        by_cat = self._by_category(expenses)
+        return self._summary_from(self._by_category(month),
+                                  self.budget.get_totals(month=month),
+                                  len(self.budget.read_all(month=month)))
+
+    def _summary_from(self, by_cat, total, count):
         breakdown = [
             {"category": cat, "amount": amt,
              "percent": round(amt / total * 100, 1) if total else 0}
             for cat, amt in sorted(by_cat.items(), key=lambda x: -x[1])
         ]
-        return {"total": total, "count": len(expenses), "breakdown": breakdown}
+        return {"total": total, "count": count, "breakdown": breakdown}
 
     # ── Pie Chart ────────────────────────────
     def pie_chart(self, month=None):
-        expenses = self.budget.read_all(month=month)
-        if not expenses:
+        by_cat, version = self.budget.snapshot(lambda: self._by_category(month))
+        return self._pie_chart_from(by_cat, version, month)
+
+    def _pie_chart_from(self, by_cat, version, month=None):
+        if not by_cat:
             return None
-        by_cat = self._by_category(expenses)
+        fname = self._chart_file("pie", version, month)
+        cached = self._cached(fname)
+        if cached:
+            return cached
         labels, sizes = list(by_cat.keys()), list(by_cat.values())
-        colors = list(plt.cm.Set3.colors[:len(labels)])
-        fig, ax = plt.subplots(figsize=(7, 5))
-        _, texts, autotexts = ax.pie(
-            sizes, labels=labels, autopct="%1.1f%%",
-            colors=colors, explode=[0.04] * len(labels),
-            startangle=140, textprops={"fontsize": 11}
-        )
-        for at in autotexts:
-            at.set_fontweight("bold")
-        title = "Spending by Category" + (f"  ({month})" if month else "")
-        ax.set_title(title, fontsize=13, fontweight="bold", pad=20)
-        plt.tight_layout()
-        path = os.path.join(CHART_DIR, "pie.png")
-        plt.savefig(path, dpi=120, bbox_inches="tight")
-        plt.close()
-        return "static/charts/pie.png"
+        colors = [_CAT_COLORS[c] for c in labels]
+        with self._locks["pie"]:
+            fig = self._figs["pie"]
+            ax = fig.axes[0]
+            ax.clear()
+            _, texts, autotexts = ax.pie(
+                sizes, labels=labels, autopct="%1.1f%%",
+                colors=colors, explode=_EXPLODE[:len(labels)],
+                startangle=140, textprops={"fontsize": 11}
+            )
+            for at in autotexts:
+                at.set_fontweight("bold")
+            title = "Spending by Category" + (f"  ({month})" if month else "")
+            ax.set_title(title, fontsize=13, fontweight="bold", pad=20)
+            return self._save("pie", fname, fig, version)
 
     # ── Line Chart ───────────────────────────
     def line_chart(self, month=None):
-        expenses = self.budget.read_all(month=month)
-        if not expenses:
+        by_day, version = self.budget.snapshot(lambda: self._by_day(month))
+        return self._line_chart_from(by_day, version, month)
+
+    def _line_chart_from(self, by_day, version, month=None):
+        if not by_day:
             return None
-        by_day = self._by_day(expenses)
-        dates = [datetime.strptime(d, "%Y-%m-%d") for d in by_day]
+        fname = self._chart_file("line", version, month)
+        cached = self._cached(fname)
+        if cached:
+            return cached
+        dates = list(by_day)
         amounts = list(by_day.values())
-        fig, ax = plt.subplots(figsize=(9, 4))
-        ax.plot(dates, amounts, marker="o", linewidth=2,
-                color="#4C72B0", markersize=6, markerfacecolor="#DD8452")
-        ax.fill_between(dates, amounts, alpha=0.15, color="#4C72B0")
-        ax.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))
-        ax.xaxis.set_major_locator(mdates.AutoDateLocator())
-        fig.autofmt_xdate()
-        ax.set_xlabel("Date", fontsize=11)
-        ax.set_ylabel("Amount (₱)", fontsize=11)
-        ax.set_title("Daily Spending Trend" + (f"  ({month})" if month else ""),
-                     fontsize=13, fontweight="bold")
-        ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: f"₱{x:,.0f}"))
-        ax.grid(axis="y", linestyle="--", alpha=0.6)
-        plt.tight_layout()
-        path = os.path.join(CHART_DIR, "line.png")
-        plt.savefig(path, dpi=120, bbox_inches="tight")
-        plt.close()
-        return "static/charts/line.png"
+        with self._locks["line"]:
+            fig = self._figs["line"]
+            ax = fig.axes[0]
+            ax.clear()
+            # Keep axes and text vector but bitmap a dense data layer
+            rasterized = len(dates) > RASTERIZE_POINTS
+            ax.plot(dates, amounts, marker="o", linewidth=2, rasterized=rasterized,
+                    color="#4C72B0", markersize=6, markerfacecolor="#DD8452")
+            ax.fill_between(dates, amounts, alpha=0.15, color="#4C72B0",
+                            rasterized=rasterized)
+            ax.xaxis.set_major_formatter(_DAY_FMT)
+            ax.xaxis.set_major_locator(_DAY_LOCATOR)
+            # What autofmt_xdate() does, minus its subplots_adjust(); the
+            # figure's bottom margin is already fixed in __init__.
+            for label in ax.get_xticklabels():
+                label.set(rotation=30, ha="right")
+            ax.set_xlabel("Date", fontsize=11)
+            ax.set_ylabel("Amount (₱)", fontsize=11)
+            ax.set_title("Daily Spending Trend" + (f"  ({month})" if month else ""),
+                         fontsize=13, fontweight="bold")
+            ax.yaxis.set_major_formatter(_PESO_FMT_LINE)
+            ax.grid(axis="y", linestyle="--", alpha=0.6)
+            return self._save("line", fname, fig, version)
 
     # ── Monthly Bar Chart ────────────────────
     def monthly_chart(self):
-        expenses = self.budget.read_all()
-        if not expenses:
+        by_month, version = self.budget.snapshot(self._by_month)
+        return self._monthly_chart_from(by_month, version)
+
+    def _monthly_chart_from(self, by_month, version):
+        if not by_month:
             return None
-        by_month = self._by_month(expenses)
+        fname = self._chart_file("monthly", version)
+        cached = self._cached(fname)
+        if cached:
+            return cached
         months, amounts = list(by_month.keys()), list(by_month.values())
-        fig, ax = plt.subplots(figsize=(9, 4))
-        bars = ax.bar(months, amounts, color="#4C72B0", edgecolor="white", width=0.5)
-        for bar, amt in zip(bars, amounts):
-            ax.text(bar.get_x() + bar.get_width() / 2,
-                    bar.get_height() + max(amounts) * 0.01,
-                    f"₱{amt:,.0f}", ha="center", va="bottom", fontsize=9)
-        ax.set_xlabel("Month", fontsize=11)
-        ax.set_ylabel("Total (₱)", fontsize=11)
-        ax.set_title("Monthly Spending Overview", fontsize=13, fontweight="bold")
-        ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: f"₱{x:,.0f}"))
-        ax.grid(axis="y", linestyle="--", alpha=0.6)
-        plt.tight_layout()
-        path = os.path.join(CHART_DIR, "monthly.png")
-        plt.savefig(path, dpi=120, bbox_inches="tight")
-        plt.close()
-        return "static/charts/monthly.png"
+        with self._locks["monthly"]:
+            fig = self._figs["monthly"]
+            ax = fig.axes[0]
+            ax.clear()
+            bars = ax.bar(months, amounts, color="#4C72B0", edgecolor="white", width=0.5)
+            for bar, amt in zip(bars, amounts):
+                ax.text(bar.get_x() + bar.get_width() / 2,
+                        bar.get_height() + max(amounts) * 0.01,
+                        f"₱{amt:,.0f}", ha="center", va="bottom", fontsize=9)
+            ax.set_xlabel("Month", fontsize=11)
+            ax.set_ylabel("Total (₱)", fontsize=11)
+            ax.set_title("Monthly Spending Overview", fontsize=13, fontweight="bold")
+            ax.yaxis.set_major_formatter(_PESO_FMT_BAR)
+            ax.grid(axis="y", linestyle="--", alpha=0.6)
+            return self._save("monthly", fname, fig, version)
+
+    # ── Analytics Page ───────────────────────
+    def report(self, month=None):
+        """Summary plus all three charts from a single aggregation pass."""
+        (by_cat, by_day, by_month, total, count), version = self.budget.snapshot(
+            lambda: self._aggregate_all(month))
+        charts = {
+            "pie": self._pie_chart_from(by_cat, version, month),
+            "line": self._line_chart_from(by_day, version, month),
+            "monthly": self._monthly_chart_from(by_month, version),
+        }
+        return self._summary_from(by_cat, total, count), charts
@@ -5,7 +5,6 @@ Visit: http://localhost:5000
 """
 
 import os
-import time
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 from expense import Expense
 from budget import Budget
@@ -16,6 +15,8 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Flask uses relative 'templates' and 'static' folders next to app.py
 app = Flask(__name__)
 app.secret_key = "budget-tracker-secret"
+# Chart URLs change whenever their data does, so browsers may cache them
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 3600
 
 budget = Budget()
 analytics = Analytics(budget)
@@ -35,8 +36,9 @@ def index():
         category=category if category else None,
         month=month if month else None
     )
-    expenses = sorted(expenses, key=lambda e: e.date, reverse=True)
-    total = sum(e.amount for e in expenses)
+    expenses = expenses[::-1]  # read_all is oldest-first; show newest first
+    total = budget.get_totals(category=category if category else None,
+                              month=month if month else None)
     
     # Pagination
     total_pages = (len(expenses) + per_page - 1) // per_page
@@ -77,8 +79,7 @@ def add():
 # ─────────────────────────────────────────────
 @app.route("/edit/<expense_id>")
 def edit(expense_id):
-    expenses = budget.read_all()
-    exp = next((e for e in expenses if e.id == expense_id), None)
+    exp = budget.get(expense_id)
     if not exp:
         return jsonify({"error": "Not found"}), 404
     return jsonify(exp.to_dict())
@@ -123,29 +124,31 @@ def delete(expense_id):
 @app.route("/analytics")
 def analytics_page():
     month = request.args.get("month", "")
-    summary = analytics.summary(month=month if month else None)
-    ts = int(time.time())
-    pie = analytics.pie_chart(month=month if month else None)
-    line = analytics.line_chart(month=month if month else None)
-    monthly = analytics.monthly_chart()
+    # Chart files are already named per month and version; ts only changes
+    # with the data, so browsers keep serving cached charts between visits.
+    ts = budget.version
+    summary, charts = analytics.report(month=month if month else None)
     return render_template("index.html",
                            view="analytics",
                            summary=summary,
-                           pie_chart=pie,
-                           line_chart=line,
-                           monthly_chart=monthly,
+                           pie_chart=charts["pie"],
+                           line_chart=charts["line"],
+                           monthly_chart=charts["monthly"],
                            selected_month=month,
                            categories=Expense.CATEGORIES,
                            ts=ts)
 
 
-import threading
-import webview
-
 def start_flask():
-    app.run(debug=False, port=5000)
+    # waitress serves requests on a thread pool, so the analytics page's
+    # chart images load in parallel instead of queueing behind each other
+    from waitress import serve
+    serve(app, host="127.0.0.1", port=5000, threads=8)
 
 if __name__ == "__main__":
+    import threading
+    import webview
+
     # Start Flask in background thread
     threading.Thread(target=start_flask, daemon=True).start()
 
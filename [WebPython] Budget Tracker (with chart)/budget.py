@@ -3,7 +3,12 @@ budget.py — Budget CRUD operations with CSV file persistence
 """
 
 import os
+import re
 import csv
+import atexit
+import threading
+from bisect import bisect_left, insort
+import numpy as np
 from expense import Expense
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -12,19 +17,73 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 class Budget:
     FILE = os.path.join(BASE_DIR, "expenses.csv")
     FIELDNAMES = ["id", "amount", "category", "description", "date"]
+    SAVE_DELAY = 1.0  # seconds to batch full rewrites after update/delete
+    # Case-insensitive filter value -> category name as stored
+    CATEGORY_KEYS = {c.lower(): c for c in Expense.CATEGORIES}
+    # Category name -> small integer code used by the column arrays
+    CATEGORY_CODES = {c: i for i, c in enumerate(Expense.CATEGORIES)}
 
     def __init__(self):
         self.expenses: list[Expense] = []
+        # Lookup indexes, kept in step with self.expenses on every mutation
+        self._by_id: dict[str, Expense] = {}
+        self._by_cat: dict[str, list[Expense]] = {}
+        self._by_month: dict[str, list[Expense]] = {}
+        # Running (sum, count) per category, month and (month, category),
+        # maintained alongside the indexes; an entry is dropped when its
+        # count reaches zero so float drift can't leave ghost totals.
+        self._total = 0.0
+        self._total_by_cat: dict[str, tuple[float, int]] = {}
+        self._total_by_month: dict[str, tuple[float, int]] = {}
+        self._total_by_month_cat: dict[tuple[str, str], tuple[float, int]] = {}
+        # Bumped on every mutation so derived artifacts (charts) know when
+        # they are stale. Seeded from the file's mtime so it keeps moving
+        # forward across restarts instead of repeating earlier values.
+        self.version = os.stat(self.FILE).st_mtime_ns if os.path.exists(self.FILE) else 0
+        # (amounts, category codes, days) arrays, rebuilt lazily per version
+        self._columns = None
+        self._columns_version = None
+        # Guards mutations and file writes; a pending full rewrite is
+        # flushed by a short-lived timer thread or at interpreter exit.
+        self._lock = threading.RLock()
+        self._save_pending = False
+        self._save_timer = None
+        atexit.register(self.flush)
+        self._next_id = 1
         self._load()
 
     # ── Persistence ──────────────────────────
     def _load(self):
-        if not os.path.exists(self.FILE):
+        if not os.path.exists(self.FILE) or os.path.getsize(self.FILE) == 0:
+            self._save()
             return
         with open(self.FILE, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                self.expenses.append(Expense.from_dict(row))
+            # Plain csv.reader: rows come back as lists, so no dict is built
+            # per row just to be unpacked again by Expense.from_dict().
+            reader = csv.reader(f)
+            header = next(reader)
+            i_id, i_amount, i_cat, i_desc, i_date = (
+                header.index(name) for name in self.FIELDNAMES)
+            loaded = [Expense(row[i_amount], row[i_cat], row[i_desc],
+                              row[i_date], row[i_id])
+                      for row in reader if row]
+        # New ids continue past the largest existing hex id (older files
+        # hold random 8-hex-digit ids and hand-written ones like "e001")
+        self._next_id = max((self._id_number(e.id) for e in loaded), default=0) + 1
+        # Rows saved with a blank id, or repeating an earlier row's id (e.g.
+        # a hand-edited file), get a fresh one, written back later
+        seen = set()
+        for exp in loaded:
+            if not exp.id or exp.id in seen:
+                exp.id = self._new_id()
+                self._save_pending = True
+            seen.add(exp.id)
+        # Sort once; indexing in order then only ever appends at the end
+        loaded.sort(key=self._order)
+        for exp in loaded:
+            self._index(exp)
+        if self._save_pending:
+            self._schedule_save()
 
     def _save(self):
         with open(self.FILE, "w", newline="", encoding="utf-8") as f:
@@ -33,42 +92,239 @@ class Budget:
             for exp in self.expenses:
                 writer.writerow(exp.to_dict())
 
+    def _append_row(self, exp: Expense):
+        with open(self.FILE, "a", newline="", encoding="utf-8") as f:
+            csv.DictWriter(f, fieldnames=self.FIELDNAMES).writerow(exp.to_dict())
+
+    def _schedule_save(self):
+        self._save_pending = True
+        # Timer state only changes under the lock: flush() clears it there,
+        # so a timer that is still exiting never swallows a new rewrite
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.SAVE_DELAY, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Write out any pending rewrite now."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._save_pending:
+                self._save_pending = False
+                self._save()
+
+    # ── Indexes ──────────────────────────────
+    # self.expenses and every index list stay sorted by (date, id), so
+    # callers get expenses in date order without sorting.
+    @staticmethod
+    def _order(exp: Expense) -> tuple:
+        return exp.date, exp.id
+
+    def _index(self, exp: Expense):
+        self._by_id[exp.id] = exp
+        insort(self.expenses, exp, key=self._order)
+        insort(self._by_cat.setdefault(exp.category.lower(), []), exp, key=self._order)
+        insort(self._by_month.setdefault(exp.date[:7], []), exp, key=self._order)
+        self._tally(exp, 1)
+
+    def _unindex(self, exp: Expense):
+        del self._by_id[exp.id]
+        for lst in (self.expenses, self._by_cat[exp.category.lower()],
+                    self._by_month[exp.date[:7]]):
+            # Find this very object, not just the first with its (date, id)
+            i = bisect_left(lst, self._order(exp), key=self._order)
+            while lst[i] is not exp:
+                i += 1
+            del lst[i]
+        self._tally(exp, -1)
+
+    def _tally(self, exp: Expense, sign: int):
+        """Add (sign=1) or remove (sign=-1) an expense from the running totals."""
+        month = exp.date[:7]
+        for table, key in ((self._total_by_cat, exp.category),
+                           (self._total_by_month, month),
+                           (self._total_by_month_cat, (month, exp.category))):
+            total, count = table.get(key, (0.0, 0))
+            if count + sign:
+                table[key] = (total + sign * exp.amount, count + sign)
+            else:
+                del table[key]
+        self._total += sign * exp.amount
+        if not self._by_id:
+            self._total = 0.0
+
+    # ── IDs ──────────────────────────────────
+    @staticmethod
+    def _id_number(expense_id: str) -> int:
+        try:
+            return int(expense_id, 16)
+        except ValueError:
+            return 0
+
+    def _new_id(self) -> str:
+        expense_id = f"{self._next_id:08x}"
+        self._next_id += 1
+        return expense_id
+
     # ── CRUD ─────────────────────────────────
     def add(self, expense: Expense) -> Expense:
-        self.expenses.append(expense)
-        self._save()
+        with self._lock:
+            if expense.id is None:
+                expense.id = self._new_id()
+            self._index(expense)
+            self.version += 1
+            # A pending rewrite already includes the new row
+            if not self._save_pending:
+                self._append_row(expense)
         return expense
 
+    def get(self, expense_id: str) -> "Expense | None":
+        return self._by_id.get(expense_id)
+
     def read_all(self, category: str = None, month: str = None) -> list[Expense]:
-        result = self.expenses
+        """Expenses matching the filters, oldest first. Wherever possible
+        this is self.expenses or an index list itself rather than a copy,
+        so callers must treat the result as read-only."""
+        if category:
+            by_cat = self._by_cat.get(category.lower(), [])
+        if month:
+            if len(month) == 7:
+                by_month = self._by_month.get(month, [])
+            else:
+                by_month = [e for e in self.expenses if e.date.startswith(month)]
+        if category and month:
+            # A filter that matches every expense narrows nothing
+            if len(by_month) == len(self.expenses):
+                return by_cat
+            if len(by_cat) == len(self.expenses):
+                return by_month
+            # Walk the smaller list and test membership in the other
+            if len(by_cat) <= len(by_month):
+                return [e for e in by_cat if e.date.startswith(month)]
+            return [e for e in by_month if e.category.lower() == category.lower()]
         if category:
-            result = [e for e in result if e.category.lower() == category.lower()]
+            return by_cat
         if month:
-            result = [e for e in result if e.date.startswith(month)]
-        return result
+            return by_month
+        return self.expenses
 
     def update(self, expense_id: str, **kwargs) -> "Expense | None":
-        for exp in self.expenses:
-            if exp.id == expense_id:
-                if "amount" in kwargs:
-                    exp.amount = float(kwargs["amount"])
-                if "category" in kwargs and kwargs["category"] in Expense.CATEGORIES:
-                    exp.category = kwargs["category"]
-                if "description" in kwargs:
-                    exp.description = kwargs["description"].strip()
-                if "date" in kwargs:
-                    exp.date = kwargs["date"]
-                self._save()
-                return exp
-        return None
+        with self._lock:
+            exp = self._by_id.get(expense_id)
+            if not exp:
+                return None
+            # Validate everything that can raise before touching the expense,
+            # so a bad value leaves it (and the file) exactly as it was
+            if "amount" in kwargs:
+                amount = float(kwargs["amount"])
+            if "date" in kwargs:
+                Expense.parse_date(kwargs["date"])
+            self._unindex(exp)
+            if "amount" in kwargs:
+                exp.amount = amount
+            if "category" in kwargs and kwargs["category"] in Expense.CATEGORIES:
+                exp.category = kwargs["category"]
+            if "description" in kwargs:
+                exp.description = kwargs["description"].strip()
+            if "date" in kwargs:
+                exp.date = kwargs["date"]
+            self._index(exp)
+            self.version += 1
+            self._schedule_save()
+        return exp
 
     def delete(self, expense_id: str) -> bool:
-        original = len(self.expenses)
-        self.expenses = [e for e in self.expenses if e.id != expense_id]
-        if len(self.expenses) < original:
-            self._save()
-            return True
-        return False
+        with self._lock:
+            exp = self._by_id.get(expense_id)
+            if not exp:
+                return False
+            self._unindex(exp)
+            self.version += 1
+            self._schedule_save()
+        return True
+
+    def snapshot(self, fn):
+        """Return (fn(), version) with no mutation in between, so a result
+        derived from the expenses can be labelled with its data version."""
+        with self._lock:
+            return fn(), self.version
+
+    def columns(self, month: str = None) -> tuple:
+        """Return (amounts, category codes, days) as parallel NumPy arrays,
+        optionally restricted to one month, for vectorized aggregation.
+        Codes index into Expense.CATEGORIES.
+        Days are datetime64[D], taken from each expense's pre-parsed day,
+        and come out sorted like self.expenses."""
+        with self._lock:
+            if self._columns_version != self.version:
+                self._columns = (
+                    np.fromiter((e.amount for e in self.expenses), dtype=np.float64,
+                                count=len(self.expenses)),
+                    np.fromiter((self.CATEGORY_CODES[e.category] for e in self.expenses),
+                                dtype=np.intp, count=len(self.expenses)),
+                    np.array([e.day for e in self.expenses], dtype="datetime64[D]"),
+                )
+                self._columns_version = self.version
+            amounts, codes, days = self._columns
+            if not month:
+                return amounts, codes, days
+            # Same rule as read_all: the month is a prefix of the date string.
+            # A canonical "YYYY", "YYYY-MM" or "YYYY-MM-DD" prefix is exactly
+            # a datetime64 comparison at that precision; anything else falls
+            # back to testing the strings themselves.
+            if re.fullmatch(r"\d{4}(-\d{2}){0,2}", month):
+                try:
+                    prefix = np.datetime64(month)
+                    mask = days.astype(prefix.dtype) == prefix
+                except ValueError:
+                    # e.g. "2026-13": stored dates are valid, so none match
+                    mask = np.zeros(len(days), dtype=bool)
+            else:
+                mask = np.fromiter((e.date.startswith(month) for e in self.expenses),
+                                   dtype=bool, count=len(self.expenses))
+        return amounts[mask], codes[mask], days[mask]
+
+    # ── Totals ───────────────────────────────
+    def get_totals(self, category: str = None, month: str = None) -> float:
+        """Total spent for the given filters, read from the running sums."""
+        if month and len(month) != 7:
+            return sum(e.amount for e in self.read_all(category, month))
+        cat = self.CATEGORY_KEYS.get(category.lower()) if category else None
+        with self._lock:
+            if category and month:
+                entry = self._total_by_month_cat.get((month, cat))
+            elif category:
+                entry = self._total_by_cat.get(cat)
+            elif month:
+                entry = self._total_by_month.get(month)
+            else:
+                return self._total
+        return entry[0] if entry else 0.0
+
+    def category_totals(self, month: str = None) -> dict[str, float]:
+        """Per-category totals in Expense.CATEGORIES order, skipping empty ones."""
+        if month and len(month) != 7:
+            # No running sums at this granularity: one bincount over the
+            # category codes sums every category in a single C loop.
+            amounts, codes, _ = self.columns(month)
+            sums = np.bincount(codes, weights=amounts, minlength=len(Expense.CATEGORIES))
+            counts = np.bincount(codes, minlength=len(Expense.CATEGORIES))
+            return {c: float(sums[i]) for i, c in enumerate(Expense.CATEGORIES)
+                    if counts[i]}
+        with self._lock:
+            if month:
+                entries = ((c, self._total_by_month_cat.get((month, c)))
+                           for c in Expense.CATEGORIES)
+            else:
+                entries = ((c, self._total_by_cat.get(c)) for c in Expense.CATEGORIES)
+            return {c: entry[0] for c, entry in entries if entry}
+
+    def month_totals(self) -> dict[str, float]:
+        """Per-month totals in month order."""
+        with self._lock:
+            return {m: entry[0] for m, entry in sorted(self._total_by_month.items())}
 
     def total(self, **filters) -> float:
-        return sum(e.amount for e in self.read_all(**filters))
+        return self.get_totals(**filters)
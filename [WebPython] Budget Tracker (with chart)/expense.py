@@ -2,8 +2,7 @@
 expense.py — Expense data model
 """
 
-import uuid
-from datetime import datetime
+from datetime import date, datetime
 
 
 class Expense:
@@ -14,12 +13,32 @@ class Expense:
 
     def __init__(self, amount: float, category: str, description: str,
                  date_str: str = None, expense_id: str = None):
-        self.id = expense_id or str(uuid.uuid4())[:8]
+        self.id = expense_id  # None until Budget.add() assigns one
         self.amount = float(amount)
         self.category = category if category in self.CATEGORIES else "Other"
         self.description = description.strip()
         self.date = date_str or datetime.today().strftime("%Y-%m-%d")
 
+    @staticmethod
+    def parse_date(value: str) -> date:
+        """Parse a YYYY-MM-DD date. Other ISO forms that fromisoformat()
+        takes (e.g. "20260115", "2026-W03-1") are rejected, because
+        filters match months on the date string's "YYYY-MM" prefix."""
+        day = date.fromisoformat(value)
+        if day.isoformat() != value:
+            raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+        return day
+
+    @property
+    def date(self) -> str:
+        return self._date
+
+    @date.setter
+    def date(self, value: str):
+        # Parsed once here so charts never have to strptime per render
+        self.day = self.parse_date(value)
+        self._date = value
+
     def to_dict(self) -> dict:
         return {
             "id": self.id,